@@ -6,6 +6,8 @@ import logging.handlers
 from flask import Flask
 from logging.config import dictConfig
 from logging import FileHandler
+from ddmail_dmcp_keyhandler.journal import Journal
+from ddmail_dmcp_keyhandler.flight_recorder import FlightRecorder, install_dump_signal
 
 
 def create_app(config_file=None, test_config=None):
@@ -100,6 +102,25 @@ def create_app(config_file=None, test_config=None):
         else:
             print("Error: you need to set LOGLEVEL to ERROR/WARNING/INFO/DEBUG")
             sys.exit(1)
+
+        # Configure operation journal, optional.
+        journal_config = toml_config[mode].get("JOURNAL", {})
+        if journal_config.get("ENABLED") is True:
+            app.extensions["journal"] = Journal(journal_config["JOURNAL_FILE"])
+
+        # Configure interval of background readiness checks, optional.
+        health_config = toml_config[mode].get("HEALTH", {})
+        readiness_interval = health_config.get("CHECK_INTERVAL", 30)
+
+        # Configure flight recorder of recent requests, optional.
+        recorder_config = toml_config[mode].get("FLIGHT_RECORDER", {})
+        if recorder_config.get("ENABLED") is True:
+            recorder = FlightRecorder(recorder_config["CAPACITY"], recorder_config["SLOWEST"], recorder_config["STDERR_LIMIT"])
+            app.extensions["flight_recorder"] = recorder
+            if recorder_config.get("DUMP_SIGNAL"):
+                app.config["FLIGHT_RECORDER_DUMP_SIGNAL"] = recorder_config["DUMP_SIGNAL"]
+                app.config["FLIGHT_RECORDER_DUMP_FILE"] = recorder_config["DUMP_FILE"]
+                install_dump_signal(recorder, recorder_config["DUMP_SIGNAL"], recorder_config["DUMP_FILE"], app.logger)
     else:
         print("Error: you need to set env variabel MODE to PRODUCTION/TESTING/DEVELOPMENT")
         sys.exit(1)
@@ -116,4 +137,11 @@ def create_app(config_file=None, test_config=None):
     from ddmail_dmcp_keyhandler import application
     app.register_blueprint(application.bp)
 
+    from ddmail_dmcp_keyhandler import health
+    app.extensions["readiness"] = health.ReadinessChecker(app, readiness_interval)
+    app.register_blueprint(health.bp)
+
+    from ddmail_dmcp_keyhandler import flight_recorder
+    app.register_blueprint(flight_recorder.bp)
+
     return app
@@ -6,9 +6,115 @@ import ddmail_validators.validators as validators
 from flask import Blueprint, current_app, request, make_response, Response
 from argon2 import PasswordHasher
 from argon2.exceptions import VerifyMismatchError
+from ddmail_dmcp_keyhandler import flight_recorder
+from ddmail_dmcp_keyhandler.journal import JournalError
 
 bp = Blueprint("application", __name__, url_prefix="/")
 
+DOAS_BIN = "/usr/bin/doas"
+
+
+def _execute_doveadm(doveadm: str, args: list) -> subprocess.CompletedProcess:
+    """
+    Run doveadm with args through doas.
+
+    Raises:
+        subprocess.CalledProcessError: If the command returns non zero
+    """
+    return subprocess.run([DOAS_BIN, doveadm] + args, check=True, stderr=subprocess.PIPE)
+
+
+def run_doveadm(operation: str, email: str, doveadm: str, args: list) -> subprocess.CompletedProcess:
+    """
+    Run a doveadm command, recording it in the operation journal and flight recorder if enabled.
+
+    The begin record is durable before the command is started and the end record
+    is durable before this function returns, so a crashed worker leaves a begin
+    record without an end record behind. stderr of a failing command is logged
+    with the secrets of the request redacted.
+
+    Args:
+        operation (str): Name of the operation, used in the journal
+        email (str): The email address the operation is run for
+        doveadm (str): Path to the doveadm binary
+        args (list): Arguments to doveadm
+
+    Returns:
+        subprocess.CompletedProcess: The finished process
+
+    Raises:
+        subprocess.CalledProcessError: If the command returns non zero
+        JournalError: If the begin record could not be written, doveadm is not run
+    """
+    journal = current_app.extensions.get("journal")
+
+    # Refuse to run doveadm without a durable begin record, JournalError propagates.
+    op_id = journal.begin(operation, email) if journal is not None else None
+
+    start = time.monotonic()
+    try:
+        with flight_recorder.stage("doveadm"):
+            output = _execute_doveadm(doveadm, args)
+    except subprocess.CalledProcessError as e:
+        flight_recorder.note_doveadm(email, e.returncode, e.stderr)
+        stderr = flight_recorder.redacted(e.stderr)
+        if stderr:
+            current_app.logger.error("doveadm stderr: " + stderr)
+        _journal_end(journal, op_id, e.returncode, "error", start)
+        raise
+    except BaseException:
+        _journal_end(journal, op_id, None, "exception", start)
+        raise
+
+    flight_recorder.note_doveadm(email, output.returncode, output.stderr)
+    _journal_end(journal, op_id, output.returncode, "done" if output.returncode == 0 else "error", start)
+    return output
+
+
+def _journal_end(journal, op_id: str, exit_code, outcome: str, start: float) -> None:
+    """
+    Record the outcome of an operation in the journal if enabled.
+
+    doveadm has already run, so a failing write is only logged and the
+    operation is left unfinished in the journal.
+    """
+    if journal is None:
+        return
+
+    try:
+        journal.end(op_id, exit_code, outcome, time.monotonic() - start)
+    except JournalError as e:
+        current_app.logger.error(str(e))
+
+
+def verify_password(ph: PasswordHasher, password: str) -> bool:
+    """
+    Verify password against the admin PASSWORD_HASH, timed as the argon2 stage.
+
+    Raises:
+        VerifyMismatchError: If password is wrong
+    """
+    with flight_recorder.stage("argon2"):
+        return ph.verify(current_app.config["PASSWORD_HASH"], password)
+
+
+def throttle() -> None:
+    """Sleep one second to slow down password guessing, timed as the throttle stage."""
+    with flight_recorder.stage("throttle"):
+        time.sleep(1)
+
+
+@bp.before_request
+def begin_flight_record() -> None:
+    """Start recording the request in the flight recorder if enabled."""
+    flight_recorder.begin(request.endpoint)
+
+
+@bp.after_request
+def finish_flight_record(response: Response) -> Response:
+    """Add the finished request to the flight recorder if enabled."""
+    return flight_recorder.finish(response)
+
 
 @bp.route("/create_key", methods=["POST"])
 def create_key() -> Response:
@@ -36,6 +142,7 @@ def create_key() -> Response:
         "error: wrong password": If admin password is incorrect
         "error: doveadm binary location is wrong": If doveadm binary doesn't exist
         "error: returncode of cmd doveadm is non zero": If doveadm command fails
+        "error: failed to write operation journal": If the journal is enabled and can not be written
         "error: unkown exception running subprocess": If an unexpected error occurs
 
     Success Response:
@@ -50,6 +157,7 @@ def create_key() -> Response:
     email = request.form.get("email")
     key_password = request.form.get("key_password")
     password = request.form.get("password")
+    flight_recorder.redact(key_password, password)
 
     # Check if input from form is None.
     if email is None:
@@ -78,18 +186,19 @@ def create_key() -> Response:
     if validators.is_password_allowed(password) != True:
         current_app.logger.error("password validation failed")
         return make_response("error: password validation failed", 200)
+    flight_recorder.mark("validation")
 
     # Check if password is correct.
     try:
-        if not ph.verify(current_app.config["PASSWORD_HASH"], password):
-            time.sleep(1)
+        if not verify_password(ph, password):
+            throttle()
             current_app.logger.error("wrong password")
             return make_response("error: wrong password", 200)
     except VerifyMismatchError:
-        time.sleep(1)
+        throttle()
         current_app.logger.error("exceptions VerifyMismatchError, wrong password")
         return make_response("error: wrong password", 200)
-    time.sleep(1)
+    throttle()
 
     doveadm = current_app.config["DOVEADM_BIN"]
 
@@ -100,10 +209,11 @@ def create_key() -> Response:
 
     # Create key with password
     try:
-        output = subprocess.run(
+        output = run_doveadm(
+            "create_key",
+            email,
+            doveadm,
             [
-                "/usr/bin/doas",
-                doveadm,
                 "-o",
                 "crypt_user_key_password=" + key_password,
                 "mailbox",
@@ -113,7 +223,6 @@ def create_key() -> Response:
                 email,
                 "-U",
             ],
-            check=True,
         )
 
         if output.returncode != 0:
@@ -122,6 +231,9 @@ def create_key() -> Response:
     except subprocess.CalledProcessError as e:
         current_app.logger.error("returncode of cmd doveadm is non zero")
         return make_response("error: returncode of cmd doveadm is non zero", 200)
+    except JournalError as e:
+        current_app.logger.error(str(e))
+        return make_response("error: failed to write operation journal", 200)
     except:
         current_app.logger.error("unkown exception running subprocess")
         return make_response("error: unkown exception running subprocess", 200)
@@ -160,6 +272,7 @@ def change_password_on_key() -> Response:
         "error: wrong password": If admin password is incorrect
         "error: doveadm binary location is wrong": If doveadm binary doesn't exist
         "error: returncode of cmd doveadm is non zero": If doveadm command fails
+        "error: failed to write operation journal": If the journal is enabled and can not be written
         "error: unkown exception running subprocess": If an unexpected error occurs
 
     Success Response:
@@ -174,6 +287,7 @@ def change_password_on_key() -> Response:
     current_key_password = request.form.get("current_key_password")
     new_key_password = request.form.get("new_key_password")
     password = request.form.get("password")
+    flight_recorder.redact(current_key_password, new_key_password, password)
 
     # Check if input from form is None.
     if email is None:
@@ -211,18 +325,19 @@ def change_password_on_key() -> Response:
     if validators.is_password_allowed(password) != True:
         current_app.logger.error("password validation failed")
         return make_response("error: password validation failed", 200)
+    flight_recorder.mark("validation")
 
     # Check if password is correct.
     try:
-        if not ph.verify(current_app.config["PASSWORD_HASH"], password):
-            time.sleep(1)
+        if not verify_password(ph, password):
+            throttle()
             current_app.logger.error("wrong password")
             return make_response("error: wrong password", 200)
     except:
-        time.sleep(1)
+        throttle()
         current_app.logger.error("wrong password")
         return make_response("error: wrong password", 200)
-    time.sleep(1)
+    throttle()
 
     doveadm = current_app.config["DOVEADM_BIN"]
 
@@ -233,10 +348,11 @@ def change_password_on_key() -> Response:
 
     # Change password on key.
     try:
-        output = subprocess.run(
+        output = run_doveadm(
+            "change_password_on_key",
+            email,
+            doveadm,
             [
-                "/usr/bin/doas",
-                doveadm,
                 "mailbox",
                 "cryptokey",
                 "password",
@@ -247,7 +363,6 @@ def change_password_on_key() -> Response:
                 "-o",
                 current_key_password,
             ],
-            check=True,
         )
         if output.returncode != 0:
             current_app.logger.error("returncode of cmd doveadm is non zero")
@@ -255,6 +370,9 @@ def change_password_on_key() -> Response:
     except subprocess.CalledProcessError as e:
         current_app.logger.error("returncode of cmd doveadm is non zero")
         return make_response("error: returncode of cmd doveadm is non zero", 200)
+    except JournalError as e:
+        current_app.logger.error(str(e))
+        return make_response("error: failed to write operation journal", 200)
     except:
         current_app.logger.error("unkown exception running subprocess")
         return make_response("error: unkonwn exception running subprocess", 200)
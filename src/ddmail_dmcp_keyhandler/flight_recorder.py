@@ -0,0 +1,271 @@
+import os
+import json
+import time
+import heapq
+import signal
+import itertools
+import threading
+import contextlib
+import collections
+import ddmail_validators.validators as validators
+from flask import Blueprint, current_app, g, request, has_request_context, make_response, jsonify, Response
+from argon2 import PasswordHasher
+
+bp = Blueprint("flight_recorder", __name__, url_prefix="/")
+
+REDACTED = "[redacted]"
+
+# Max length of the response message kept for each request.
+RESULT_LIMIT = 128
+
+# Default max length of doveadm stderr that is kept or logged.
+STDERR_LIMIT = 512
+
+
+class FlightRecorder:
+    """Per worker ring buffer of recent requests, with the slowest kept separately.
+
+    The recent requests are kept in a ring buffer of capacity entries and the
+    slowest requests in a heap of slowest entries, so the memory used is fixed
+    and outliers are not pushed out by a burst of fast requests. Entries never
+    contain passwords, doveadm stderr is redacted and truncated.
+    """
+
+    def __init__(self, capacity, slowest, stderr_limit):
+        """Create a flight recorder.
+
+        Args:
+            capacity (int): Number of recent requests to keep.
+            slowest (int): Number of slowest requests to keep.
+            stderr_limit (int): Max number of characters of doveadm stderr to keep.
+        """
+        self.slowest = slowest
+        self.stderr_limit = stderr_limit
+        self._lock = threading.Lock()
+        self._recent = collections.deque(maxlen=capacity)
+        self._slowest = []
+        self._seq = itertools.count()
+
+    def add(self, entry):
+        """Add a finished request entry."""
+        with self._lock:
+            self._recent.append(entry)
+
+            item = (entry["duration"], next(self._seq), entry)
+            if len(self._slowest) < self.slowest:
+                heapq.heappush(self._slowest, item)
+            elif self.slowest > 0 and item[0] > self._slowest[0][0]:
+                heapq.heapreplace(self._slowest, item)
+
+    def dump(self):
+        """Return recent requests, oldest first, and slowest requests, slowest first."""
+        with self._lock:
+            return {
+                "pid": os.getpid(),
+                "recent": list(self._recent),
+                "slowest": [entry for duration, seq, entry in sorted(self._slowest, reverse=True)],
+            }
+
+
+def _recorder():
+    """Return the flight recorder of the current app, None if it is disabled."""
+    return current_app.extensions.get("flight_recorder")
+
+
+def _entry():
+    """Return the entry of the current request, None if nothing is recorded."""
+    if not has_request_context():
+        return None
+
+    return g.get("flight_record")
+
+
+def parse_request_start(header, now):
+    """Return seconds since the X-Request-Start header value, None if it is invalid.
+
+    Accepts "t=<seconds>" with fractions as set by nginx and plain milliseconds
+    or microseconds since the epoch.
+    """
+    if header is None:
+        return None
+
+    try:
+        start = float(header.strip().replace("t=", ""))
+    except ValueError:
+        return None
+
+    if start > 1e14:
+        start = start / 1e6
+    elif start > 1e11:
+        start = start / 1e3
+
+    return round(max(0.0, now - start), 6)
+
+
+def begin(endpoint):
+    """Start recording the current request."""
+    if _recorder() is None:
+        return
+
+    now = time.time()
+    g.flight_record = {
+        "endpoint": endpoint,
+        "time": now,
+        "queue_wait": parse_request_start(request.headers.get("X-Request-Start"), now),
+        "stages": {},
+        "user": None,
+        "exit_code": None,
+        "stderr": None,
+    }
+    g.flight_start = g.flight_mark = time.monotonic()
+
+
+def redact(*secrets):
+    """Register secrets of the current request that redacted() removes from output."""
+    g.setdefault("flight_secrets", []).extend(secret for secret in secrets if secret)
+
+
+def redacted(output, limit=STDERR_LIMIT):
+    """Return output with the secrets of the current request removed, truncated to limit.
+
+    Args:
+        output (bytes or str): Output of a command, for example its stderr.
+        limit (int): Max number of characters to return.
+
+    Returns:
+        str: The redacted output, None if output is not bytes or str.
+    """
+    if isinstance(output, bytes):
+        output = output.decode("utf-8", errors="replace")
+    if not isinstance(output, str):
+        return None
+
+    for secret in g.get("flight_secrets", []):
+        output = output.replace(secret, REDACTED)
+
+    return output[:limit]
+
+
+def mark(name):
+    """Record stage name as lasting from the previous stage, or request start, until now."""
+    entry = _entry()
+    if entry is None:
+        return
+
+    now = time.monotonic()
+    entry["stages"][name] = round(now - g.flight_mark, 6)
+    g.flight_mark = now
+
+
+@contextlib.contextmanager
+def stage(name):
+    """Record the time spent in the with block as stage name."""
+    entry = _entry()
+    if entry is None:
+        yield
+        return
+
+    g.flight_mark = time.monotonic()
+    try:
+        yield
+    finally:
+        mark(name)
+
+
+def note_doveadm(user, exit_code, stderr):
+    """Record the user, exit code and redacted stderr of the doveadm command."""
+    entry = _entry()
+    if entry is None:
+        return
+
+    entry["user"] = user
+    entry["exit_code"] = exit_code
+    entry["stderr"] = redacted(stderr, _recorder().stderr_limit)
+
+
+def finish(response):
+    """Add the current request to the flight recorder and return response."""
+    entry = _entry()
+    if entry is None:
+        return response
+
+    entry["duration"] = round(time.monotonic() - g.flight_start, 6)
+    entry["status"] = response.status_code
+    entry["result"] = response.get_data(as_text=True)[:RESULT_LIMIT]
+    _recorder().add(entry)
+    g.flight_record = None
+
+    return response
+
+
+def install_dump_signal(recorder, signame, dump_file, logger):
+    """Write a dump of recorder to dump_file.<pid> when signal signame is received.
+
+    The dump is written from a new thread, so the signal handler never waits for
+    the lock of the recorder. The handler can only be installed from the main thread.
+    """
+    def write_dump():
+        path = dump_file + "." + str(os.getpid())
+        try:
+            with open(path + ".tmp", 'w') as f:
+                json.dump(recorder.dump(), f)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            logger.error("failed to write flight recorder dump to " + path + ": " + str(e))
+
+    def handler(signum, frame):
+        threading.Thread(target=write_dump, daemon=True).start()
+
+    try:
+        signal.signal(getattr(signal, signame), handler)
+    except (AttributeError, ValueError) as e:
+        logger.warning("can not install flight recorder dump signal " + signame + ": " + str(e))
+
+
+@bp.route("/flight_recorder", methods=["POST"])
+def dump() -> Response:
+    """
+    Dump the flight recorder of the worker handling the request.
+
+    Request Form Parameters:
+        password (str): Admin password to authenticate the request
+
+    Error Responses:
+        "error: password is none": If password parameter is missing
+        "error: password validation failed": If password fails validation
+        "error: wrong password": If admin password is incorrect
+        "error: flight recorder is disabled": If the flight recorder is not enabled
+
+    Success Response:
+        JSON with pid, recent and slowest requests
+    """
+    ph = PasswordHasher()
+
+    password = request.form.get("password")
+
+    if password is None:
+        current_app.logger.error("password is None")
+        return make_response("error: password is none", 200)
+
+    if validators.is_password_allowed(password) != True:
+        current_app.logger.error("password validation failed")
+        return make_response("error: password validation failed", 200)
+
+    # Check if password is correct.
+    try:
+        if not ph.verify(current_app.config["PASSWORD_HASH"], password):
+            time.sleep(1)
+            current_app.logger.error("wrong password")
+            return make_response("error: wrong password", 200)
+    except:
+        time.sleep(1)
+        current_app.logger.error("wrong password")
+        return make_response("error: wrong password", 200)
+    time.sleep(1)
+
+    recorder = _recorder()
+    if recorder is None:
+        current_app.logger.error("flight recorder is disabled")
+        return make_response("error: flight recorder is disabled", 200)
+
+    return make_response(jsonify(recorder.dump()), 200)
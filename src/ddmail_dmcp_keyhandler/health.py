@@ -0,0 +1,159 @@
+import os
+import stat
+import time
+import threading
+import logging.handlers
+from logging import FileHandler
+from flask import Blueprint, current_app, make_response, jsonify, Response
+from ddmail_dmcp_keyhandler.application import DOAS_BIN
+
+bp = Blueprint("health", __name__, url_prefix="/")
+
+
+def _writable(path):
+    """Return True if path is a writable file or can be created as one."""
+    if os.path.exists(path):
+        return os.path.isfile(path) and os.access(path, os.W_OK)
+
+    return os.access(os.path.dirname(os.path.abspath(path)), os.W_OK)
+
+
+def check_doveadm(doveadm):
+    """Return (ok, detail) for the doveadm binary being an executable file."""
+    if os.path.isfile(doveadm) and os.access(doveadm, os.X_OK):
+        return True, "ok"
+
+    return False, doveadm + " is not an executable file"
+
+
+def check_doas(doas):
+    """Return (ok, detail) for doas being an executable setuid root binary."""
+    try:
+        st = os.stat(doas)
+    except OSError as e:
+        return False, str(e)
+
+    if not stat.S_ISREG(st.st_mode) or not os.access(doas, os.X_OK):
+        return False, doas + " is not an executable file"
+
+    if st.st_uid != 0 or not st.st_mode & stat.S_ISUID:
+        return False, doas + " is not setuid root"
+
+    return True, "ok"
+
+
+def check_log_handlers(logger):
+    """Return (ok, detail) for all file and syslog handlers of logger being writable."""
+    for handler in logger.handlers:
+        if isinstance(handler, FileHandler):
+            if not _writable(handler.baseFilename):
+                return False, handler.baseFilename + " is not writable"
+        elif isinstance(handler, logging.handlers.SysLogHandler) and isinstance(handler.address, str):
+            try:
+                is_socket = stat.S_ISSOCK(os.stat(handler.address).st_mode)
+            except OSError:
+                is_socket = False
+            if not is_socket or not os.access(handler.address, os.W_OK):
+                return False, handler.address + " is not a writable socket"
+
+    return True, "ok"
+
+
+def check_journal(journal):
+    """Return (ok, detail) for the journal file being writable, if the journal is enabled."""
+    if journal is None or _writable(journal.path):
+        return True, "ok"
+
+    return False, journal.path + " is not writable"
+
+
+class ReadinessChecker:
+    """Cache the result of periodic readiness checks of the backend.
+
+    The checks only stat files and never fork a process. They are run inline on
+    the first request in a worker and after that by a background thread every
+    interval seconds, so requests only read the cached result.
+    """
+
+    def __init__(self, app, interval):
+        """Create a readiness checker for app.
+
+        Args:
+            app (Flask): The application to check.
+            interval (float): Seconds between background checks.
+        """
+        self.app = app
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._pid = None
+        self._result = None
+
+    def run_checks(self):
+        """Run all checks and return the result as a dict."""
+        checks = {
+            "doveadm": check_doveadm(self.app.config["DOVEADM_BIN"]),
+            "doas": check_doas(DOAS_BIN),
+            "logging": check_log_handlers(self.app.logger),
+            "journal": check_journal(self.app.extensions.get("journal")),
+        }
+
+        return {
+            "ready": all(ok for ok, detail in checks.values()),
+            "checks": {name: detail for name, (ok, detail) in checks.items()},
+            "checked_at": time.time(),
+        }
+
+    def result(self):
+        """Return the cached result, starting the background checks in this process if needed."""
+        with self._lock:
+            # Threads do not survive a fork, start one per worker process.
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._result = self.run_checks()
+                thread = threading.Thread(target=self._loop, args=(self._pid,), daemon=True)
+                thread.start()
+
+            return self._result
+
+    def _loop(self, pid):
+        """Refresh the cached result every interval seconds."""
+        while self._pid == pid:
+            time.sleep(self.interval)
+            try:
+                result = self.run_checks()
+            except Exception as e:
+                result = {"ready": False, "checks": {"error": str(e)}, "checked_at": time.time()}
+            self._result = result
+
+
+@bp.route("/healthz", methods=["GET"])
+def healthz() -> Response:
+    """
+    Liveness check, does no I/O.
+
+    Success Response:
+        "ok": The worker is running
+    """
+    return make_response("ok", 200)
+
+
+@bp.route("/readyz", methods=["GET"])
+def readyz() -> Response:
+    """
+    Readiness check reporting the cached result of the background checks.
+
+    The result is also reported as not ready if it has not been refreshed for
+    three check intervals, for example because the background thread died.
+
+    Returns:
+        Response: JSON with ready, checks and checked_at, status code 200 if
+                  ready and 503 if not ready
+    """
+    checker = current_app.extensions["readiness"]
+    result = dict(checker.result())
+
+    if time.time() - result["checked_at"] > 3 * checker.interval:
+        result["ready"] = False
+        result["checks"] = dict(result["checks"], stale="result is older than 3 check intervals")
+
+    return make_response(jsonify(result), 200 if result["ready"] else 503)
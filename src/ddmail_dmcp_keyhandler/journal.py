@@ -0,0 +1,252 @@
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import threading
+
+
+class JournalError(Exception):
+    """Raised when records could not be made durable in the journal."""
+
+
+class _CommitGroup:
+    """Records that are written and fsynced together."""
+
+    def __init__(self):
+        self.lines = []
+        self.done = False
+        self.error = None
+
+
+class Journal:
+    """Append-only operation journal with group-committed fsyncs.
+
+    Every doveadm operation writes a "begin" record before it is started and an
+    "end" record when it has finished. Each record is one JSON object per line.
+    Records are made durable with fsync before the caller continues, but
+    concurrent callers share fsyncs: the first caller that finds no commit in
+    progress writes and fsyncs every record queued so far, while the others
+    wait for that commit to cover their record.
+
+    Key passwords and the admin password are never written to the journal.
+    """
+
+    def __init__(self, path):
+        """Create a journal that appends to the file at path.
+
+        Args:
+            path (str): Path to the journal file, created if it does not exist.
+        """
+        self.path = path
+        self._fd = None
+        self._cond = threading.Condition()
+        self._group = _CommitGroup()
+        self._committing = False
+
+    def begin(self, operation, user):
+        """Record the intent to run an operation and return its id.
+
+        Args:
+            operation (str): Name of the operation, for example "create_key".
+            user (str): The email address the operation is run for.
+
+        Returns:
+            str: Unique id of the operation, used for the matching end record.
+
+        Raises:
+            JournalError: If the record could not be made durable.
+        """
+        op_id = uuid.uuid4().hex
+        self._append({
+            "id": op_id,
+            "event": "begin",
+            "operation": operation,
+            "user": user,
+            "pid": os.getpid(),
+            "time": time.time(),
+        })
+        return op_id
+
+    def end(self, op_id, exit_code, outcome, duration):
+        """Record the outcome of an operation started with begin().
+
+        Args:
+            op_id (str): Id returned by begin().
+            exit_code (int): Exit code of doveadm, None if it never returned one.
+            outcome (str): "done", "error" or "exception".
+            duration (float): Seconds the operation took.
+
+        Raises:
+            JournalError: If the record could not be made durable.
+        """
+        self._append({
+            "id": op_id,
+            "event": "end",
+            "exit_code": exit_code,
+            "outcome": outcome,
+            "duration": round(duration, 6),
+            "pid": os.getpid(),
+            "time": time.time(),
+        })
+
+    def _append(self, record):
+        """Queue record and return when a commit covering it has been fsynced."""
+        line = (json.dumps(record, sort_keys=True) + "\n").encode("utf-8")
+
+        with self._cond:
+            group = self._group
+            group.lines.append(line)
+
+            while not group.done:
+                if self._committing:
+                    self._cond.wait()
+                    continue
+
+                # Become the committer for everything queued so far, records
+                # queued from now on go to the next group.
+                self._committing = True
+                self._group = _CommitGroup()
+
+                self._cond.release()
+                try:
+                    self._commit(group.lines)
+                except OSError as e:
+                    group.error = e
+                finally:
+                    self._cond.acquire()
+                    self._committing = False
+                    group.done = True
+                    self._cond.notify_all()
+
+        if group.error is not None:
+            raise JournalError("failed to write " + str(len(group.lines)) + " records to journal: " + str(group.error))
+
+    def _open(self):
+        """Open the journal file and return data that must be written before the first record."""
+        created = not os.path.exists(self.path)
+        prefix = b""
+
+        # A crash can leave a torn last record, terminate it so the next record
+        # starts on a line of its own.
+        if not created:
+            with open(self.path, 'rb') as f:
+                f.seek(0, os.SEEK_END)
+                if f.tell() > 0:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        prefix = b"\n"
+
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+
+        # Make the directory entry of a new journal file durable.
+        if created:
+            try:
+                dir_fd = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+                try:
+                    os.fsync(dir_fd)
+                finally:
+                    os.close(dir_fd)
+            except OSError:
+                os.close(fd)
+                raise
+
+        self._fd = fd
+        return prefix
+
+    def _commit(self, lines):
+        """Write lines to the journal file and fsync it.
+
+        On any failure the file is closed, so the next commit reopens it and
+        terminates a record torn by a partial write, and a failed fsync is never
+        retried on the same file descriptor.
+        """
+        prefix = b""
+
+        # Open lazily so a journal created before a fork is opened per worker.
+        if self._fd is None:
+            prefix = self._open()
+
+        data = memoryview(prefix + b"".join(lines))
+        try:
+            while len(data) > 0:
+                written = os.write(self._fd, data)
+                data = data[written:]
+            os.fsync(self._fd)
+        except OSError:
+            fd = self._fd
+            self._fd = None
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+            raise
+
+
+def read_records(path):
+    """Read all records from a journal file.
+
+    Lines that can not be parsed, for example a record torn by a crash, are skipped.
+
+    Args:
+        path (str): Path to the journal file.
+
+    Returns:
+        list: Journal records as dicts in file order.
+    """
+    records = []
+    with open(path, 'r') as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+
+    return records
+
+
+def unfinished_operations(path):
+    """Return begin records that have no matching end record.
+
+    Args:
+        path (str): Path to the journal file.
+
+    Returns:
+        list: Begin records of operations that never finished, oldest first.
+    """
+    begun = {}
+    for record in read_records(path):
+        if record.get("event") == "begin":
+            begun[record["id"]] = record
+        elif record.get("event") == "end":
+            begun.pop(record.get("id"), None)
+
+    return list(begun.values())
+
+
+def main(argv=None):
+    """List operations in a journal file that were started but never finished.
+
+    Operations still running in a live worker are also listed, so run this
+    after the service has been stopped or crashed to find operations to recover.
+    """
+    parser = argparse.ArgumentParser(description="List unfinished operations in a ddmail_dmcp_keyhandler journal.")
+    parser.add_argument("journal_file", help="Path to the journal file.")
+    args = parser.parse_args(argv)
+
+    try:
+        unfinished = unfinished_operations(args.journal_file)
+    except OSError as e:
+        print("Error: can not read journal file: " + str(e), file=sys.stderr)
+        return 1
+
+    for record in unfinished:
+        started = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(record["time"]))
+        print(started + " pid=" + str(record["pid"]) + " " + record["operation"] + " " + record["user"] + " id=" + record["id"])
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,192 @@
+import os
+import sys
+import signal
+import argparse
+import importlib.util
+import toml
+from argon2 import PasswordHasher, extract_parameters
+from argon2.exceptions import InvalidHashError
+from gunicorn.app.base import BaseApplication
+from ddmail_dmcp_keyhandler import create_app
+from ddmail_dmcp_keyhandler.flight_recorder import install_dump_signal
+
+# Upper limit of threads per worker, requests mostly wait on sleep and doveadm.
+MAX_THREADS = 32
+
+
+def argon2_memory_cost(password_hash):
+    """Return the argon2 memory cost in KiB of password_hash.
+
+    Falls back to the argon2_cffi default if the hash can not be parsed.
+    """
+    try:
+        return extract_parameters(password_hash).memory_cost
+    except (InvalidHashError, ValueError):
+        return PasswordHasher().memory_cost
+
+
+def physical_memory():
+    """Return the physical memory in bytes, None if it is unknown."""
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def auto_size(cpu_count, memory_cost, memory_budget, workers=None):
+    """Return (workers, threads) sized from cpu count and argon2 memory cost.
+
+    Verifying the admin password is CPU bound, so there is one worker per CPU.
+    The rest of a request is spent waiting on the throttle sleep and doveadm, so
+    each worker gets as many threads as the memory budget allows when every
+    thread verifies a password at the same time. Workers are reduced until
+    workers * threads verifies fit in the budget, with at least one worker with
+    one thread even if a single verify does not fit.
+
+    Args:
+        cpu_count (int): Number of CPUs.
+        memory_cost (int): argon2 memory cost in KiB for one password verify.
+        memory_budget (int): Bytes that concurrent password verifies may use.
+        workers (int, optional): Number of workers to size threads for, default auto sized.
+
+    Returns:
+        tuple: Number of workers and number of threads per worker.
+    """
+    verify_bytes = max(1, memory_cost * 1024)
+    if workers is None:
+        workers = max(1, min(cpu_count, memory_budget // verify_bytes))
+    threads = max(1, min(MAX_THREADS, memory_budget // (workers * verify_bytes)))
+
+    return workers, threads
+
+
+def post_worker_init(worker):
+    """Install the flight recorder dump signal in a worker.
+
+    Gunicorn resets signal handlers in each worker, which removes the handler
+    installed by create_app when the application is preloaded.
+    """
+    app = worker.wsgi
+    recorder = app.extensions.get("flight_recorder")
+    if recorder is not None and app.config.get("FLIGHT_RECORDER_DUMP_SIGNAL"):
+        install_dump_signal(recorder, app.config["FLIGHT_RECORDER_DUMP_SIGNAL"],
+                            app.config["FLIGHT_RECORDER_DUMP_FILE"], app.logger)
+
+
+def ignore_signal_in_master(signame):
+    """Return a gunicorn when_ready hook that makes the master ignore signal signame.
+
+    The default action of most signals terminates the process, so a flight
+    recorder dump signal sent to every process would otherwise kill the master.
+    Workers inherit the ignored signal and post_worker_init installs the dump handler.
+    """
+    def when_ready(server):
+        signal.signal(getattr(signal, signame), signal.SIG_IGN)
+
+    return when_ready
+
+
+class KeyhandlerServer(BaseApplication):
+    """Gunicorn application running ddmail_dmcp_keyhandler with the given settings."""
+
+    def __init__(self, config_file, options):
+        """Create the server for config_file with gunicorn settings in options."""
+        self.config_file = config_file
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        """Apply options to the gunicorn configuration."""
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        """Create the Flask application."""
+        return create_app(config_file=self.config_file)
+
+
+def build_options(args, password_hash):
+    """Return gunicorn settings for the parsed command line args.
+
+    Args:
+        args (argparse.Namespace): Parsed command line arguments.
+        password_hash (str): The argon2 hash of the admin password from the config file.
+
+    Returns:
+        dict: Gunicorn settings.
+    """
+    memory_budget = args.memory_budget * 1024 * 1024 if args.memory_budget else None
+    if memory_budget is None:
+        memory_budget = (physical_memory() or 1024 * 1024 * 1024) // 4
+
+    workers, threads = auto_size(os.cpu_count() or 1, argon2_memory_cost(password_hash), memory_budget, args.workers)
+
+    options = {
+        "bind": args.bind,
+        "workers": workers,
+        "preload_app": args.preload,
+        "timeout": args.timeout,
+        "pidfile": args.pid,
+        "keepalive": 5,
+        "post_worker_init": post_worker_init,
+    }
+
+    if args.worker_class == "async":
+        options["worker_class"] = "gevent"
+        options["worker_connections"] = args.threads or threads
+    else:
+        options["worker_class"] = "gthread"
+        options["threads"] = args.threads or threads
+
+    return options
+
+
+def main(argv=None):
+    """Start ddmail_dmcp_keyhandler under gunicorn with tuned settings."""
+    parser = argparse.ArgumentParser(description="Run ddmail_dmcp_keyhandler under gunicorn.")
+    parser.add_argument("--config", required=True, help="Path to configuration file in toml format.")
+    parser.add_argument("--mode", choices=["PRODUCTION", "TESTING", "DEVELOPMENT"], default=None,
+                        help="Configuration MODE, defaults to the MODE env variable.")
+    parser.add_argument("--bind", default="127.0.0.1:8002", help="Address to listen on, default 127.0.0.1:8002.")
+    parser.add_argument("--worker-class", choices=["threaded", "async"], default="threaded",
+                        help="threaded uses gthread workers, async uses gevent workers. Default threaded.")
+    parser.add_argument("--workers", type=int, default=None, help="Number of workers, default auto sized.")
+    parser.add_argument("--threads", type=int, default=None,
+                        help="Threads or async connections per worker, default auto sized.")
+    parser.add_argument("--memory-budget", type=int, default=None,
+                        help="MiB that concurrent argon2 password verifies may use, default a quarter of memory.")
+    parser.add_argument("--timeout", type=int, default=60, help="Worker timeout in seconds, default 60.")
+    parser.add_argument("--preload", action="store_true", help="Load the application before forking workers.")
+    parser.add_argument("--pid", default=None, help="Write the pid of the gunicorn master to this file.")
+    args = parser.parse_args(argv)
+
+    if args.mode is not None:
+        os.environ["MODE"] = args.mode
+
+    mode = os.environ.get('MODE')
+    if mode != "PRODUCTION" and mode != "TESTING" and mode != "DEVELOPMENT":
+        print("Error: you need to set env variabel MODE or --mode to PRODUCTION/TESTING/DEVELOPMENT")
+        return 1
+
+    if args.worker_class == "async" and importlib.util.find_spec("gevent") is None:
+        print("Error: --worker-class async requires gevent to be installed")
+        return 1
+
+    with open(args.config, 'r') as f:
+        toml_config = toml.load(f)
+
+    options = build_options(args, toml_config[mode]["PASSWORD_HASH"])
+
+    recorder_config = toml_config[mode].get("FLIGHT_RECORDER", {})
+    if recorder_config.get("ENABLED") is True and recorder_config.get("DUMP_SIGNAL"):
+        if not hasattr(signal, recorder_config["DUMP_SIGNAL"]):
+            print("Error: unknown DUMP_SIGNAL " + recorder_config["DUMP_SIGNAL"])
+            return 1
+        options["when_ready"] = ignore_signal_in_master(recorder_config["DUMP_SIGNAL"])
+    KeyhandlerServer(args.config, options).run()
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -365,3 +365,52 @@ def test_create_key_password_verify_error(client, monkeypatch, mocker):
     })
     assert response.status_code == 200
     assert b"error: wrong password" in response.data
+
+def test_create_key_doveadm_command(client, monkeypatch, password, mocker):
+    """Test the exact doveadm command run when creating a key
+
+    This test verifies that create_key runs one doas doveadm process per key, with
+    the key password as a global option before the mailbox cryptokey generate command.
+    """
+    monkeypatch.setitem(client.application.config, "DOVEADM_BIN", "/bin/ls")
+
+    mock_run = mocker.patch('subprocess.run')
+    mock_run.return_value.returncode = 0
+
+    response = client.post("/create_key", data={
+        "password": password,
+        "key_password": "validBase64Key==",
+        "email": "test@test.se"
+    })
+    assert b"done" in response.data
+    mock_run.assert_called_once_with(
+        ["/usr/bin/doas", "/bin/ls", "-o", "crypt_user_key_password=validBase64Key==",
+         "mailbox", "cryptokey", "generate", "-u", "test@test.se", "-U"],
+        check=True,
+        stderr=subprocess.PIPE,
+    )
+
+def test_change_password_on_key_doveadm_command(client, monkeypatch, password, mocker):
+    """Test the exact doveadm command run when changing password on a key
+
+    This test verifies that change_password_on_key runs one doas doveadm process
+    with the user, new and old password given to mailbox cryptokey password.
+    """
+    monkeypatch.setitem(client.application.config, "DOVEADM_BIN", "/bin/ls")
+
+    mock_run = mocker.patch('subprocess.run')
+    mock_run.return_value.returncode = 0
+
+    response = client.post("/change_password_on_key", data={
+        "password": password,
+        "current_key_password": "aDfrdf43DFR432dFtrfde43E",
+        "new_key_password": "dDFrdswD34fdSed3fdRtfrtf",
+        "email": "test@test.se"
+    })
+    assert b"done" in response.data
+    mock_run.assert_called_once_with(
+        ["/usr/bin/doas", "/bin/ls", "mailbox", "cryptokey", "password", "-u", "test@test.se",
+         "-n", "dDFrdswD34fdSed3fdRtfrtf", "-o", "aDfrdf43DFR432dFtrfde43E"],
+        check=True,
+        stderr=subprocess.PIPE,
+    )
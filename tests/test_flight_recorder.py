@@ -0,0 +1,115 @@
+import os
+import json
+import time
+import signal
+import subprocess
+from ddmail_dmcp_keyhandler import flight_recorder
+from ddmail_dmcp_keyhandler.flight_recorder import FlightRecorder
+
+
+def entry(duration):
+    """Return a minimal flight recorder entry lasting duration seconds."""
+    return {"endpoint": "application.create_key", "duration": duration}
+
+def test_flight_recorder_ring_buffer():
+    """Test that the flight recorder keeps a fixed number of recent entries
+
+    This test verifies that old entries are pushed out of the ring buffer while
+    the slowest entries are kept separately, slowest first.
+    """
+    recorder = FlightRecorder(3, 2, 512)
+    for duration in [40.0, 1.0, 2.0, 3.0, 4.0, 30.0, 5.0]:
+        recorder.add(entry(duration))
+
+    dump = recorder.dump()
+    assert [e["duration"] for e in dump["recent"]] == [4.0, 30.0, 5.0]
+    assert [e["duration"] for e in dump["slowest"]] == [40.0, 30.0]
+    assert dump["pid"] == os.getpid()
+
+def test_parse_request_start():
+    """Test parsing of the X-Request-Start header"""
+    now = 1700000010.0
+    assert flight_recorder.parse_request_start("t=1700000009.5", now) == 0.5
+    assert flight_recorder.parse_request_start("1700000009000", now) == 1.0
+    assert flight_recorder.parse_request_start("1700000008000000", now) == 2.0
+    assert flight_recorder.parse_request_start("t=1700000011", now) == 0.0
+    assert flight_recorder.parse_request_start("garbage", now) is None
+    assert flight_recorder.parse_request_start(None, now) is None
+
+def test_change_password_on_key_recorded(client, password, mocker):
+    """Test that a failing password change is recorded with redacted stderr
+
+    This test verifies that stage timings, exit code and queue wait are recorded
+    and that key passwords in doveadm stderr are redacted.
+    """
+    recorder = FlightRecorder(8, 4, 512)
+    client.application.extensions["flight_recorder"] = recorder
+    client.application.config["DOVEADM_BIN"] = "/bin/ls"
+
+    mock_run = mocker.patch('subprocess.run')
+    mock_run.side_effect = subprocess.CalledProcessError(
+        1, "cmd", stderr=b"Error: failed to decrypt key with password aDfrdf43DFR432dFtrfde43E")
+
+    response = client.post("/change_password_on_key", headers={"X-Request-Start": "t=" + str(time.time() - 2)}, data={
+        "password": password,
+        "current_key_password": "aDfrdf43DFR432dFtrfde43E",
+        "new_key_password": "dDFrdswD34fdSed3fdRtfrtf",
+        "email": "test@test.se"
+    })
+    assert b"error: returncode of cmd doveadm is non zero" in response.data
+
+    recorded = recorder.dump()["recent"]
+    assert len(recorded) == 1
+    e = recorded[0]
+    assert e["endpoint"] == "application.change_password_on_key"
+    assert set(e["stages"]) == {"validation", "argon2", "throttle", "doveadm"}
+    assert e["stages"]["throttle"] >= 1
+    assert e["exit_code"] == 1
+    assert e["user"] == "test@test.se"
+    assert e["stderr"] == "Error: failed to decrypt key with password " + flight_recorder.REDACTED
+    assert e["queue_wait"] >= 2
+    assert e["result"] == "error: returncode of cmd doveadm is non zero"
+    assert "aDfrdf43DFR432dFtrfde43E" not in json.dumps(recorder.dump())
+    assert "dDFrdswD34fdSed3fdRtfrtf" not in json.dumps(recorder.dump())
+
+def test_flight_recorder_dump_endpoint(client, password):
+    """Test dumping the flight recorder through the protected endpoint
+
+    This test verifies that the dump requires the admin password and is not
+    itself recorded.
+    """
+    client.application.extensions.pop("flight_recorder", None)
+    response = client.post("/flight_recorder", data={"password": password})
+    assert b"error: flight recorder is disabled" in response.data
+
+    recorder = FlightRecorder(8, 4, 512)
+    client.application.extensions["flight_recorder"] = recorder
+    client.post("/create_key", data={"password": password, "email": "test@test.se"})
+
+    response = client.post("/flight_recorder", data={"password": "A3D4fEf3D3F45gFds23F4gfR"})
+    assert b"error: wrong password" in response.data
+
+    response = client.post("/flight_recorder", data={"password": password})
+    assert response.status_code == 200
+    assert [e["result"] for e in response.json["recent"]] == ["error: key_password is none"]
+
+def test_flight_recorder_dump_signal(tmp_path, client):
+    """Test writing a dump of the flight recorder when the dump signal is received"""
+    recorder = FlightRecorder(8, 4, 512)
+    recorder.add(entry(1.5))
+    dump_file = str(tmp_path / "flight_recorder.json")
+
+    previous = signal.getsignal(signal.SIGUSR2)
+    try:
+        flight_recorder.install_dump_signal(recorder, "SIGUSR2", dump_file, client.application.logger)
+        os.kill(os.getpid(), signal.SIGUSR2)
+
+        path = dump_file + "." + str(os.getpid())
+        for i in range(50):
+            if os.path.exists(path):
+                break
+            time.sleep(0.1)
+        with open(path) as f:
+            assert json.load(f)["recent"][0]["duration"] == 1.5
+    finally:
+        signal.signal(signal.SIGUSR2, previous)
@@ -0,0 +1,80 @@
+import os
+import time
+from ddmail_dmcp_keyhandler import health
+from ddmail_dmcp_keyhandler.journal import Journal
+
+
+def test_healthz(client):
+    """Test the liveness endpoint
+
+    This test verifies that /healthz answers ok.
+    """
+    response = client.get("/healthz")
+    assert response.status_code == 200
+    assert response.data == b"ok"
+
+def test_readyz_ready(client, mocker):
+    """Test the readiness endpoint when all checks pass
+
+    This test verifies that /readyz reports ready with status code 200.
+    """
+    mocker.patch('ddmail_dmcp_keyhandler.health.check_doas', return_value=(True, "ok"))
+    client.application.config["DOVEADM_BIN"] = "/bin/ls"
+
+    response = client.get("/readyz")
+    assert response.status_code == 200
+    assert response.json["ready"] is True
+    assert response.json["checks"]["doveadm"] == "ok"
+
+def test_readyz_not_ready(client, mocker):
+    """Test the readiness endpoint when doveadm is missing
+
+    This test verifies that /readyz reports not ready with status code 503.
+    """
+    mocker.patch('ddmail_dmcp_keyhandler.health.check_doas', return_value=(True, "ok"))
+    client.application.config["DOVEADM_BIN"] = "/nonexistent/path/to/doveadm"
+
+    response = client.get("/readyz")
+    assert response.status_code == 503
+    assert response.json["ready"] is False
+    assert "not an executable file" in response.json["checks"]["doveadm"]
+
+def test_readyz_cached(client, mocker):
+    """Test that the readiness endpoint reports the cached result
+
+    This test verifies that checks are not rerun on the request path and that a
+    result older than three check intervals is reported as stale.
+    """
+    checker = client.application.extensions["readiness"]
+    run_checks = mocker.spy(checker, "run_checks")
+
+    client.get("/readyz")
+    client.get("/readyz")
+    assert run_checks.call_count == 1
+
+    checker._result = dict(checker._result, ready=True, checked_at=time.time() - 4 * checker.interval)
+    response = client.get("/readyz")
+    assert response.status_code == 503
+    assert "stale" in response.json["checks"]
+
+def test_check_doas(tmp_path):
+    """Test the doas check
+
+    This test verifies that a missing doas and a doas that is not setuid root fail.
+    """
+    assert health.check_doas(str(tmp_path / "doas"))[0] is False
+
+    doas = tmp_path / "doas"
+    doas.write_text("")
+    os.chmod(doas, 0o755)
+    assert health.check_doas(str(doas)) == (False, str(doas) + " is not setuid root")
+
+def test_check_journal(tmp_path):
+    """Test the journal check
+
+    This test verifies that a disabled journal passes and that a journal in a
+    missing directory fails.
+    """
+    assert health.check_journal(None) == (True, "ok")
+    assert health.check_journal(Journal(str(tmp_path / "journal.log"))) == (True, "ok")
+    assert health.check_journal(Journal(str(tmp_path / "missing" / "journal.log")))[0] is False
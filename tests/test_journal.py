@@ -0,0 +1,227 @@
+import os
+import json
+import errno
+import threading
+import subprocess
+import pytest
+from ddmail_dmcp_keyhandler.journal import Journal, JournalError, read_records, unfinished_operations, main
+
+
+def test_journal_begin_end(tmp_path):
+    """Test that begin and end records are written to the journal
+
+    This test verifies that a finished operation writes one begin and one end record
+    sharing the same id, and that it is not listed as unfinished.
+    """
+    path = str(tmp_path / "journal.log")
+    journal = Journal(path)
+
+    op_id = journal.begin("create_key", "test@test.se")
+    journal.end(op_id, 0, "done", 0.5)
+
+    records = read_records(path)
+    assert [r["event"] for r in records] == ["begin", "end"]
+    assert records[0]["id"] == op_id and records[1]["id"] == op_id
+    assert records[0]["operation"] == "create_key"
+    assert records[0]["user"] == "test@test.se"
+    assert records[1]["exit_code"] == 0
+    assert unfinished_operations(path) == []
+
+def test_journal_unfinished(tmp_path):
+    """Test that operations without an end record are listed as unfinished
+
+    This test verifies that the recovery listing returns begin records without a
+    matching end record and skips a torn last line.
+    """
+    path = str(tmp_path / "journal.log")
+    journal = Journal(path)
+
+    done_id = journal.begin("create_key", "done@test.se")
+    journal.end(done_id, 0, "done", 0.1)
+    crashed_id = journal.begin("change_password_on_key", "crashed@test.se")
+    with open(path, "a") as f:
+        f.write('{"id": "torn')
+
+    unfinished = unfinished_operations(path)
+    assert [r["id"] for r in unfinished] == [crashed_id]
+
+def test_journal_append_after_torn_line(tmp_path):
+    """Test that records appended after a torn last line are not lost
+
+    This test verifies that a journal opened after a crash terminates the torn
+    record first, so the first new record is on a line of its own.
+    """
+    path = str(tmp_path / "journal.log")
+    with open(path, "w") as f:
+        f.write('{"id": "torn')
+
+    journal = Journal(path)
+    op_id = journal.begin("create_key", "test@test.se")
+    journal.end(op_id, 0, "done", 0.1)
+
+    records = read_records(path)
+    assert [r["event"] for r in records] == ["begin", "end"]
+    assert records[0]["id"] == op_id
+
+def test_journal_write_failure(tmp_path):
+    """Test that a record that can not be made durable raises JournalError"""
+    journal = Journal(str(tmp_path / "missing" / "journal.log"))
+
+    with pytest.raises(JournalError):
+        journal.begin("create_key", "test@test.se")
+
+def test_journal_short_write(tmp_path, mocker):
+    """Test that short writes are retried until the whole record is written"""
+    path = str(tmp_path / "journal.log")
+    journal = Journal(path)
+
+    real_write = os.write
+    mocker.patch('os.write', side_effect=lambda fd, data: real_write(fd, bytes(data[:10])))
+    op_id = journal.begin("create_key", "test@test.se")
+    mocker.stopall()
+
+    records = read_records(path)
+    assert [r["id"] for r in records] == [op_id]
+
+def test_journal_failed_write_then_begin(tmp_path, mocker):
+    """Test that a record after a failed partial write is not lost
+
+    This test verifies that a write failing after writing part of a record
+    raises JournalError, and that the next record is written on a line of its
+    own so the recovery listing still sees it.
+    """
+    path = str(tmp_path / "journal.log")
+    journal = Journal(path)
+    journal.begin("create_key", "a@b.se")
+
+    real_write = os.write
+    calls = []
+
+    def failing_write(fd, data):
+        calls.append(fd)
+        if len(calls) == 1:
+            return real_write(fd, bytes(data[:10]))
+        raise OSError(errno.ENOSPC, "No space left on device")
+
+    mocker.patch('os.write', side_effect=failing_write)
+    with pytest.raises(JournalError):
+        journal.begin("create_key", "b@b.se")
+    mocker.stopall()
+
+    op_id = journal.begin("change_password_on_key", "c@b.se")
+
+    unfinished = unfinished_operations(path)
+    assert [r["user"] for r in unfinished] == ["a@b.se", "c@b.se"]
+    assert unfinished[1]["id"] == op_id
+
+def test_journal_concurrent_appends(tmp_path):
+    """Test that concurrent appends are all committed as whole lines
+
+    This test verifies that group commit does not lose or interleave records
+    when many threads append at the same time.
+    """
+    path = str(tmp_path / "journal.log")
+    journal = Journal(path)
+
+    def worker(i):
+        op_id = journal.begin("create_key", "user" + str(i) + "@test.se")
+        journal.end(op_id, 0, "done", 0.0)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(20)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    with open(path) as f:
+        lines = f.readlines()
+    assert len(lines) == 40
+    assert all(json.loads(line) for line in lines)
+    assert unfinished_operations(path) == []
+
+def test_journal_main(tmp_path, capsys):
+    """Test the recovery tool listing unfinished operations
+
+    This test verifies that the command line tool prints unfinished operations
+    and returns an error for a missing journal file.
+    """
+    path = str(tmp_path / "journal.log")
+    journal = Journal(path)
+    op_id = journal.begin("create_key", "test@test.se")
+
+    assert main([path]) == 0
+    out = capsys.readouterr().out
+    assert "create_key test@test.se id=" + op_id in out
+
+    assert main([str(tmp_path / "missing.log")]) == 1
+
+def test_create_key_journaled(client, password, mocker, tmp_path):
+    """Test that create_key records its operation in the journal without secrets
+
+    This test verifies that a successful create_key writes begin and end records
+    and that the key password is never written to the journal.
+    """
+    path = str(tmp_path / "journal.log")
+    client.application.extensions["journal"] = Journal(path)
+    client.application.config["DOVEADM_BIN"] = "/bin/ls"
+
+    mock_run = mocker.patch('subprocess.run')
+    mock_run.return_value.returncode = 0
+
+    response = client.post("/create_key", data={
+        "password": password,
+        "key_password": "validBase64Key==",
+        "email": "test@test.se"
+    })
+    assert b"done" in response.data
+
+    records = read_records(path)
+    assert [r["event"] for r in records] == ["begin", "end"]
+    assert records[1]["outcome"] == "done"
+    with open(path) as f:
+        assert "validBase64Key" not in f.read()
+
+def test_change_password_on_key_journaled_error(client, password, mocker, tmp_path):
+    """Test that a failing doveadm command records its exit code in the journal
+
+    This test verifies that a non zero exit of doveadm is recorded as an error
+    with the exit code in the end record.
+    """
+    path = str(tmp_path / "journal.log")
+    client.application.extensions["journal"] = Journal(path)
+    client.application.config["DOVEADM_BIN"] = "/bin/ls"
+
+    mock_run = mocker.patch('subprocess.run')
+    mock_run.side_effect = subprocess.CalledProcessError(75, "cmd")
+
+    response = client.post("/change_password_on_key", data={
+        "password": password,
+        "current_key_password": "aDfrdf43DFR432dFtrfde43E",
+        "new_key_password": "dDFrdswD34fdSed3fdRtfrtf",
+        "email": "test@test.se"
+    })
+    assert b"error: returncode of cmd doveadm is non zero" in response.data
+
+    records = read_records(path)
+    assert records[1]["exit_code"] == 75
+    assert records[1]["outcome"] == "error"
+
+def test_create_key_journal_failure(client, password, mocker, tmp_path):
+    """Test that create_key does not run doveadm when the journal can not be written
+
+    This test verifies that the operation is refused when its begin record can
+    not be made durable.
+    """
+    client.application.extensions["journal"] = Journal(str(tmp_path / "missing" / "journal.log"))
+    client.application.config["DOVEADM_BIN"] = "/bin/ls"
+
+    mock_run = mocker.patch('subprocess.run')
+    mock_run.return_value.returncode = 0
+
+    response = client.post("/create_key", data={
+        "password": password,
+        "key_password": "validBase64Key==",
+        "email": "test@test.se"
+    })
+    assert b"error: failed to write operation journal" in response.data
+    mock_run.assert_not_called()
@@ -0,0 +1,104 @@
+import os
+import argparse
+import signal
+from argon2 import PasswordHasher
+from ddmail_dmcp_keyhandler import server
+
+MIB = 1024 * 1024
+
+
+def test_auto_size():
+    """Test sizing workers and threads from cpu count and argon2 memory cost
+
+    This test verifies that there is one worker per CPU, that threads fill the
+    memory budget and that both limits are respected.
+    """
+    # 64 MiB per verify, 4 CPUs and 2 GiB budget gives 8 threads per worker.
+    assert server.auto_size(4, 64 * 1024, 2048 * MIB) == (4, 8)
+
+    # Plenty of memory is capped at MAX_THREADS.
+    assert server.auto_size(2, 1024, 64 * 1024 * MIB) == (2, server.MAX_THREADS)
+
+    # A budget smaller than one verify per CPU reduces workers to one thread each.
+    assert server.auto_size(8, 64 * 1024, 256 * MIB) == (4, 1)
+    assert server.auto_size(8, 64 * 1024, 128 * MIB) == (2, 1)
+
+    # Never below one worker with one thread.
+    assert server.auto_size(8, 64 * 1024, 1 * MIB) == (1, 1)
+
+    # Threads are sized for the given number of workers.
+    assert server.auto_size(4, 64 * 1024, 2048 * MIB, workers=16) == (16, 2)
+
+    # Sized workers and threads stay within the budget.
+    for cpu_count in range(1, 17):
+        for budget in [64 * MIB, 256 * MIB, 1024 * MIB, 4096 * MIB]:
+            workers, threads = server.auto_size(cpu_count, 64 * 1024, budget)
+            assert workers * threads * 64 * MIB <= budget
+
+def test_argon2_memory_cost():
+    """Test reading the argon2 memory cost from the admin password hash"""
+    ph = PasswordHasher(memory_cost=2048)
+    assert server.argon2_memory_cost(ph.hash("password")) == 2048
+    assert server.argon2_memory_cost("change_me") == PasswordHasher().memory_cost
+
+def test_build_options_threaded():
+    """Test gunicorn settings for threaded workers"""
+    args = argparse.Namespace(
+        bind="127.0.0.1:8002", worker_class="threaded", workers=None, threads=None,
+        memory_budget=1024, timeout=60, preload=True, pid="/run/ddmail_dmcp_keyhandler.pid")
+    password_hash = PasswordHasher(memory_cost=64 * 1024).hash("password")
+
+    options = server.build_options(args, password_hash)
+    workers, threads = server.auto_size(os.cpu_count() or 1, 64 * 1024, 1024 * MIB)
+    assert options["worker_class"] == "gthread"
+    assert options["workers"] == workers
+    assert options["threads"] == threads
+    assert options["preload_app"] is True
+    assert options["pidfile"] == "/run/ddmail_dmcp_keyhandler.pid"
+
+def test_build_options_workers_override():
+    """Test that threads are sized for the number of workers given on the command line"""
+    args = argparse.Namespace(
+        bind="127.0.0.1:8002", worker_class="threaded", workers=16, threads=None,
+        memory_budget=2048, timeout=60, preload=False, pid=None)
+    password_hash = PasswordHasher(memory_cost=64 * 1024).hash("password")
+
+    options = server.build_options(args, password_hash)
+    assert options["workers"] == 16
+    assert options["threads"] == 2
+
+def test_build_options_async_override():
+    """Test gunicorn settings for async workers with sizes from the command line"""
+    args = argparse.Namespace(
+        bind="0.0.0.0:8002", worker_class="async", workers=3, threads=100,
+        memory_budget=None, timeout=30, preload=False, pid=None)
+
+    options = server.build_options(args, "change_me")
+    assert options["worker_class"] == "gevent"
+    assert options["workers"] == 3
+    assert options["worker_connections"] == 100
+    assert "threads" not in options
+
+def test_main(mocker, config_file):
+    """Test that main starts gunicorn with the config file from the command line"""
+    run = mocker.patch.object(server.KeyhandlerServer, "run")
+    init = mocker.spy(server.KeyhandlerServer, "__init__")
+
+    assert server.main(["--config", config_file, "--mode", "TESTING", "--workers", "2"]) == 0
+    run.assert_called_once()
+    assert init.call_args[0][1] == config_file
+    assert init.call_args[0][2]["workers"] == 2
+
+def test_ignore_signal_in_master():
+    """Test that the when_ready hook makes the master ignore the dump signal"""
+    previous = signal.getsignal(signal.SIGRTMIN)
+    try:
+        server.ignore_signal_in_master("SIGRTMIN")(None)
+        assert signal.getsignal(signal.SIGRTMIN) == signal.SIG_IGN
+    finally:
+        signal.signal(signal.SIGRTMIN, previous)
+
+def test_main_invalid_mode(monkeypatch, config_file):
+    """Test that main refuses to start without a valid MODE"""
+    monkeypatch.setenv("MODE", "WRONG")
+    assert server.main(["--config", config_file]) == 1